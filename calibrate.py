@@ -0,0 +1,203 @@
+"""
+This script tunes the analysis to the computer it runs on. It measures how fast the question classification model runs with
+different batch sizes, maximum question lengths and torch thread counts (on a sample of real transcript questions), and how fast
+the PDFs are read with different numbers of processes (on real transcript pages, if given a directory of RTs).
+The best settings are saved to tuning_profile.json, which yesno.py, word_search.py and run_all.py then load automatically.
+It can be run with: python calibrate.py /path/to/RT/directory
+(run it again after changing computers or upgrading; delete tuning_profile.json to go back to the defaults)
+"""
+# %pip install -r requirements.txt
+
+import os, csv, json, time, random, argparse, multiprocessing
+from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor
+import yesno
+
+DEFAULT_QUESTIONS_PATH = './dev/question_datasets/all_questions_unlabeled.csv'
+MIN_IMPROVEMENT = 1.05 # only move away from the default for a setting if it is at least 5% faster (smaller differences are mostly noise)
+
+
+############################### PROCESS COMMAND LINE ARGUMENTS ############################
+
+def parse_inputs():
+    parser = argparse.ArgumentParser(description='Measure and save the fastest analysis settings for this computer.')
+    parser.add_argument('path', type=str, nargs='?', default=None, help='Optional directory of transcript PDFs, to tune how many PDFs are read at once.')
+    parser.add_argument('--questions', type=str, default=DEFAULT_QUESTIONS_PATH, help='CSV of transcript questions (question_text column) to time the model on.')
+    parser.add_argument('--sample_size', type=int, default=256, help='How many questions to time the model on.')
+    parser.add_argument('--max_files', type=int, default=8, help='How many PDFs to time reading on.')
+    parser.add_argument('--profile', type=str, default=yesno.TUNING_PROFILE_PATH, help='Where to save the tuning profile.')
+    args = parser.parse_args()
+
+    if args.path and not os.path.isdir(args.path):
+        raise ValueError(f"The input directory '{args.path}' does not exist or is not a directory.")
+    if not os.path.isfile(args.questions):
+        raise ValueError(f"The questions file '{args.questions}' does not exist or is not a file.")
+    return args
+
+def load_question_sample(questions_path, sample_size, seed=0):
+    # the questions yesno.py actually sends to the model: those whose answers weren't clearly yes/no (answer_yes_no != 'Y')
+    with open(questions_path, mode='r', newline='') as file:
+        rows = list(csv.DictReader(file))
+    questions = [row['question_text'] for row in rows if row.get('answer_yes_no', 'n') != 'Y' and row['question_text']]
+    return random.Random(seed).sample(questions, min(sample_size, len(questions)))
+
+def get_core_count():
+    try:
+        import psutil
+        return psutil.cpu_count(logical=False) or os.cpu_count()
+    except ImportError:
+        return os.cpu_count()
+
+def candidate_counts(maximum):
+    # 1, 2, 4, 8... up to maximum, and maximum itself
+    counts = [1]
+    while counts[-1] * 2 < maximum:
+        counts.append(counts[-1] * 2)
+    return sorted(set(counts + [maximum]))
+
+
+############################### BENCHMARKS ################################################
+
+def time_best_of(function, repeats=2):
+    best = float('inf')
+    for _ in range(repeats):
+        start = time.perf_counter()
+        function()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+def benchmark_extraction(INPUT_DIRECTORY_PATH, max_files):
+    files = [f for f in sorted(os.listdir(INPUT_DIRECTORY_PATH)) if f.endswith('.pdf')][:max_files]
+    if not files:
+        return []
+    n_pages = sum(len(pages) for _,pages in yesno.extract_pdf_pages(INPUT_DIRECTORY_PATH, workers=1, files=files, desc='Counting pages'))
+    results = []
+    for workers in candidate_counts(min(os.cpu_count(), len(files))):
+        seconds = time_best_of(lambda: yesno.extract_pdf_pages(INPUT_DIRECTORY_PATH, workers=workers, files=files, desc=f'Reading with {workers} process(es)'), repeats=1)
+        results.append({'extraction_workers': workers, 'pages_per_second': n_pages / seconds})
+    return results
+
+def benchmark_inference(interop_threads, questions, thread_counts, batch_sizes, max_lengths):
+    """
+    Runs in its own process, because torch's inter-op thread count can only be set once per process (None leaves torch's default).
+    Tunes one setting at a time, keeping the best of the ones before: threads, then batch size, then max length.
+    """
+    import torch
+    if interop_threads is not None:
+        torch.set_num_interop_threads(interop_threads)
+    interop_default = interop_threads is None
+    interop_threads = torch.get_num_interop_threads()
+    yesno.init_classifier()
+    yesno.is_yes_no_batch(questions[:8]) # warm up
+
+    def measure(threads, batch_size, max_length):
+        torch.set_num_threads(threads)
+        predictions = []
+        seconds = time_best_of(lambda: predictions.append(yesno.is_yes_no_batch(questions, batch_size=batch_size, max_length=max_length)))
+        return {'torch_interop_threads': interop_threads, 'interop_default': interop_default, 'torch_threads': threads, 'batch_size': batch_size,
+                'max_length': max_length, 'questions_per_second': len(questions) / seconds, 'predictions': predictions[-1]}
+
+    default_threads = torch.get_num_threads()
+    results = [measure(threads, yesno.BATCH_SIZE, None) for threads in sorted(set(thread_counts) | {default_threads})] # (always including the default)
+    best_threads = max(results, key=lambda r: r['questions_per_second'])['torch_threads']
+    results += [measure(best_threads, batch_size, None) for batch_size in batch_sizes if batch_size != yesno.BATCH_SIZE]
+    best_batch_size = max([r for r in results if r['torch_threads'] == best_threads], key=lambda r: r['questions_per_second'])['batch_size']
+    results += [measure(best_threads, best_batch_size, max_length) for max_length in max_lengths]
+    return results, default_threads
+
+
+############################### CHOOSING AND EXPLAINING SETTINGS ##########################
+
+def choose_settings(inference_results, default_threads, extraction_results):
+    settings, explanation = {}, []
+
+    # reference: the default settings (batch size, no max length, torch's own thread counts) -- the predictions everything else must match
+    reference = next(r for r in inference_results if r['interop_default'] and r['torch_threads'] == default_threads
+                     and r['batch_size'] == yesno.BATCH_SIZE and r['max_length'] is None)
+    agrees = lambda r: sum(a == b for a,b in zip(r['predictions'], reference['predictions'])) / len(reference['predictions'])
+    untruncated = [r for r in inference_results if r['max_length'] is None]
+
+    # threads (intra-op and inter-op) and batch size: simply the fastest, if it's clearly faster than the default
+    fastest = max(untruncated, key=lambda r: r['questions_per_second'])
+    if fastest['questions_per_second'] < reference['questions_per_second'] * MIN_IMPROVEMENT:
+        fastest = reference
+    settings['torch_threads'] = fastest['torch_threads']
+    settings['torch_interop_threads'] = None if fastest['interop_default'] else fastest['torch_interop_threads'] # (None: leave torch's default)
+    settings['batch_size'] = fastest['batch_size']
+    interop = lambda r: f"{r['torch_interop_threads']}{', the default' if r['interop_default'] else ''}"
+    explanation.append(f"torch threads {fastest['torch_threads']} (inter-op {interop(fastest)}), batch size {fastest['batch_size']}: "
+                       f"{fastest['questions_per_second']:.1f} questions/second, vs {reference['questions_per_second']:.1f} with the defaults "
+                       f"({reference['torch_threads']} threads, inter-op {reference['torch_interop_threads']}, batch size {reference['batch_size']})")
+
+    # max length: the fastest cutoff that doesn't change any answer on the sample (most questions are short, so a cutoff rarely matters)
+    truncated = [r for r in inference_results if r['max_length'] is not None and r['torch_threads'] == fastest['torch_threads']
+                 and r['torch_interop_threads'] == fastest['torch_interop_threads'] and r['batch_size'] == fastest['batch_size']]
+    safe = [r for r in truncated if agrees(r) == 1.0]
+    best_truncated = max(safe, key=lambda r: r['questions_per_second'], default=None)
+    if best_truncated and best_truncated['questions_per_second'] >= fastest['questions_per_second'] * MIN_IMPROVEMENT:
+        settings['max_length'] = best_truncated['max_length']
+        explanation.append(f"max length {best_truncated['max_length']} tokens: {best_truncated['questions_per_second']:.1f} questions/second, "
+                           f"with the same answer as the full-length model on all {len(reference['predictions'])} sample questions")
+    elif not truncated:
+        settings['max_length'] = None
+        explanation.append('max length: no limit (cutoffs were only measured with the fastest batch size, which was not clearly faster than the default)')
+    else:
+        settings['max_length'] = None
+        changed = ', '.join(f"{r['max_length']} changes {1 - agrees(r):.1%} of answers" for r in truncated if agrees(r) < 1.0)
+        explanation.append('max length: no limit (cutting questions off ' + ('was not noticeably faster' if not changed else f'is not safe: {changed}') + ')')
+
+    # PDF reading processes: the fastest, if clearly faster than one at a time
+    if extraction_results:
+        single = next(r for r in extraction_results if r['extraction_workers'] == 1)
+        best = max(extraction_results, key=lambda r: r['pages_per_second'])
+        if best['pages_per_second'] < single['pages_per_second'] * MIN_IMPROVEMENT:
+            best = single
+        settings['extraction_workers'] = best['extraction_workers']
+        explanation.append(f"PDF reading processes {best['extraction_workers']}: {best['pages_per_second']:.1f} pages/second, vs {single['pages_per_second']:.1f} one at a time")
+    else:
+        explanation.append('PDF reading processes: not measured (no transcript directory given), keeping the default')
+
+    return settings, explanation
+
+def print_measurements(inference_results, extraction_results):
+    print(f"{'inter-op':>8} {'threads':>8} {'batch':>6} {'max len':>8} {'questions/s':>12}")
+    for r in inference_results:
+        print(f"{str(r['torch_interop_threads']) + ('*' if r['interop_default'] else ''):>8} {r['torch_threads']:>8} {r['batch_size']:>6} {str(r['max_length']):>8} {r['questions_per_second']:>12.1f}")
+    print("(* torch's default number of inter-op threads)")
+    for r in extraction_results:
+        print(f"PDF reading with {r['extraction_workers']} process(es): {r['pages_per_second']:.1f} pages/second")
+
+
+if __name__ == "__main__":
+    start_time = datetime.now()
+    args = parse_inputs()
+    questions = load_question_sample(args.questions, args.sample_size)
+    cores = get_core_count()
+    print(f'Calibrating on {len(questions)} questions, {cores} cores ({os.cpu_count()} logical processors)')
+
+    extraction_results = benchmark_extraction(args.path, args.max_files) if args.path else []
+
+    inference_results = []
+    for interop_threads in [None, 1, 2]: # None: torch's own default, the reference everything else is compared to
+        if interop_threads is not None and interop_threads == inference_results[0]['torch_interop_threads']:
+            continue # the default already is this many
+        print(f"Timing the model with {'the default number of' if interop_threads is None else interop_threads} inter-op thread(s)...")
+        with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('spawn')) as executor: # (a fresh process, not a fork of this one)
+            results, threads = executor.submit(benchmark_inference, interop_threads, questions, candidate_counts(cores),
+                                               [1, 4, 8, 16, 32, 64], [128, 64, 32]).result()
+        default_threads = threads if interop_threads is None else default_threads
+        inference_results.extend(results)
+
+    print_measurements(inference_results, extraction_results)
+    settings, explanation = choose_settings(inference_results, default_threads, extraction_results)
+
+    profile = {'date': datetime.now().strftime('%Y-%m-%d %H:%M'), 'machine': yesno.get_machine_description(), 'settings': settings, 'explanation': explanation}
+    with open(args.profile, 'w') as f:
+        json.dump(profile, f, indent=4)
+
+    print('\nChosen settings:')
+    for line in explanation:
+        print(f'    {line}')
+    print(f'Saved to {args.profile} -- yesno.py, word_search.py and run_all.py will use these settings from now on.')
+    elapsed_minutes = (datetime.now() - start_time).total_seconds() / 60
+    print(f"Script took {elapsed_minutes:.2f} minutes")
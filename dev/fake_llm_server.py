@@ -0,0 +1,58 @@
+"""
+A stand-in for an OpenAI-compatible chat completions server, for testing the LLM backend (yesno_llm.py) without an API key.
+It answers each numbered question in a request with 'yes' if it starts like a yes/no question ("DID...", "IS...") and 'no' otherwise,
+and can be made slow or flaky to exercise the rate limiting and retries.
+It can be run with: python dev/fake_llm_server.py --port 8000 --latency 0.5 --error_rate 0.1
+and then: python yesno.py /path/to/RT/directory --backend llm --llm_base_url http://localhost:8000/v1
+"""
+
+import re, json, time, random, argparse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+YES_NO_STARTS = ('DID', 'DO', 'DOES', 'IS', 'ARE', 'WAS', 'WERE', 'HAVE', 'HAS', 'HAD', 'CAN', 'COULD', 'WOULD', 'WILL', 'SHOULD', 'AND DID', 'AND WAS', 'SO')
+
+def answer_prompt(prompt):
+    answers = []
+    for line in prompt.split('\n'):
+        match = re.match(r'^(\d+)\. (.*)$', line.strip())
+        if match:
+            yes_no = match.group(2).upper().startswith(YES_NO_STARTS)
+            answers.append(f"{match.group(1)}. {'yes' if yes_no else 'no'}")
+    return '\n'.join(answers)
+
+def make_handler(latency, error_rate):
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            body = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))))
+            time.sleep(latency)
+            if random.random() < error_rate: # pretend we're rate limited
+                self.send_response(429)
+                self.send_header('Retry-After', '0.1')
+                self.end_headers()
+                return
+
+            content = answer_prompt(body['messages'][-1]['content'])
+            response = json.dumps({
+                'id': 'fake', 'object': 'chat.completion', 'model': body.get('model', 'fake'),
+                'choices': [{'index': 0, 'message': {'role': 'assistant', 'content': content}, 'finish_reason': 'stop'}],
+            }).encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(response)))
+            self.end_headers()
+            self.wfile.write(response)
+
+        def log_message(self, format, *args):
+            pass # keep the console quiet
+    return Handler
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Fake OpenAI-compatible server for testing the LLM backend.')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--latency', type=float, default=0.2, help='Seconds to wait before answering each request.')
+    parser.add_argument('--error_rate', type=float, default=0.0, help='Fraction of requests to answer with 429 (rate limited).')
+    args = parser.parse_args()
+
+    print(f'Fake LLM server listening on http://localhost:{args.port}/v1')
+    ThreadingHTTPServer(('localhost', args.port), make_handler(args.latency, args.error_rate)).serve_forever()
@@ -0,0 +1,202 @@
+"""
+Command-line version of the model evaluation in model_evaluation.ipynb.
+Runs each question classification backend over the labeled training questions and reports accuracy, precision and recall
+against `manual_yes_no`, alongside throughput (questions per second), p50/p99 latency and peak memory (RSS).
+Every run is also appended to model_evaluation_results.csv, so runs can be compared over time.
+It can be run from the top of the repository with: python dev/model_evaluation.py --backends xlmr_local --batch_sizes 1 8 32
+"""
+# %pip install -r requirements.txt
+
+import os, sys, csv, math, time, argparse
+from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__)))) # so we can import yesno.py from the top of the repository
+import yesno
+
+DEV_DIRECTORY_PATH = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_DATASET_PATH = os.path.join(DEV_DIRECTORY_PATH, 'question_datasets', 'labeled_training_questions.csv')
+DEFAULT_RESULTS_PATH = os.path.join(DEV_DIRECTORY_PATH, 'model_evaluation_results.csv')
+
+
+############################### CLASSIFICATION BACKENDS ###################################
+
+# HuggingFace models compared in model_evaluation.ipynb, with how each model's labels map onto yes/no
+HUGGINGFACE_MODELS = {
+    'scott-routledge/bert-question-classifier': {'LABEL_0': 'yes', 'LABEL_1': 'no', 'LABEL_2': 'yes'},
+    'sophiaqho/question_classifier_model_v2': {'LABEL_0': 'yes', 'LABEL_1': 'no'},
+    'alangpp255/Question_classifier_V2': {'TF': 'yes', 'WH': 'no'},
+    'ndavid/binary-question-classifier-bert': {'LABEL_0': 'no', 'LABEL_1': 'yes'},
+    'PrimeQA/tydi-boolean_question_classifier-xlmr_large-20221117': {'LABEL_0': 'yes', 'LABEL_1': 'no'},
+    'PrimeQA/tydiqa-boolean-question-classifier': {'LABEL_0': 'no', 'LABEL_1': 'yes'},
+}
+
+def classify_with_yesno(questions, batch_size):
+    # anything but True/False is yesno.py's error marker: kept as 'error' so it isn't counted as a 'no'
+    return [{True: 'yes', False: 'no'}.get(result, 'error') for result in yesno.is_yes_no_batch(questions, batch_size=batch_size)]
+
+def load_local_backend(args):
+    # the classifier yesno.py actually uses (loaded from ./model_local)
+    yesno.init_classifier()
+    return classify_with_yesno
+
+def load_llm_backend(args):
+    # OpenAI-compatible server (see yesno_llm.py), e.g. --llm_base_url http://localhost:8000/v1 with dev/fake_llm_server.py
+    yesno.init_classifier('llm', yesno.get_llm_options(args))
+    return classify_with_yesno
+
+def load_huggingface_backend(model_name):
+    from transformers import pipeline
+    label_map = HUGGINGFACE_MODELS[model_name]
+    hf_classifier = pipeline('text-classification', model=model_name)
+    def classify(questions, batch_size):
+        return [label_map.get(r['label'], 'error') for r in hf_classifier(list(questions), batch_size=batch_size)]
+    return classify
+
+# each backend name maps to a function that loads it (given the command line arguments) and returns classify(questions, batch_size) -> list of 'yes'/'no'/'error'
+BACKENDS = {'xlmr_local': load_local_backend, 'llm': load_llm_backend}
+BACKENDS.update({model_name: (lambda args, m=model_name: load_huggingface_backend(m)) for model_name in HUGGINGFACE_MODELS})
+DEFAULT_BACKENDS = [name for name in BACKENDS if name != 'llm'] # the LLM backend needs a server, so only run it when asked
+
+
+############################### PROCESS COMMAND LINE ARGUMENTS ############################
+
+def parse_inputs():
+    parser = argparse.ArgumentParser(description='Accuracy vs. throughput evaluation of the question classification backends.')
+    parser.add_argument('--backends', type=str, nargs='+', default=DEFAULT_BACKENDS, choices=list(BACKENDS.keys()), help='Which classification backends to evaluate (default: all of them except llm).')
+    parser.add_argument('--batch_sizes', type=int, nargs='+', default=[1], help='Batch sizes to evaluate each backend with.')
+    parser.add_argument('--dataset', type=str, default=DEFAULT_DATASET_PATH, help='Path to the CSV of labeled questions.')
+    parser.add_argument('--all_questions', action='store_true', help='Evaluate on every labeled question, not just the ones the yes/no answer check cannot decide (the ones yesno.py sends to the model).')
+    parser.add_argument('--limit', type=int, default=None, help='Only evaluate on the first N questions (for a quick check).')
+    parser.add_argument('--results', type=str, default=DEFAULT_RESULTS_PATH, help='CSV file that every run is appended to.')
+    yesno.add_classifier_arguments(parser) # options for the llm backend
+    args = parser.parse_args()
+
+    if not os.path.isfile(args.dataset):
+        raise ValueError(f"The dataset '{args.dataset}' does not exist or is not a file.")
+    return args
+
+
+############################### DATA LOADING ##############################################
+
+def load_labeled_questions(dataset_path, all_questions=False, limit=None):
+    with open(dataset_path, mode='r', newline='') as file:
+        rows = list(csv.DictReader(file))
+    if not all_questions:
+        rows = [row for row in rows if row['answer_yes_no'] == 'no'] # same subset as the notebook: only these are sent to the model
+    rows = [row for row in rows if row['manual_yes_no'] in ['yes', 'no']]
+    if limit:
+        rows = rows[:limit]
+    return [row['question_text'] for row in rows], [row['manual_yes_no'] for row in rows]
+
+
+############################### METRICS ###################################################
+
+def percentile(values, p):
+    # nearest-rank percentile, so we don't need numpy for two numbers
+    if not values: return float('nan')
+    ordered = sorted(values)
+    rank = max(0, min(len(ordered)-1, math.ceil(p * len(ordered) / 100) - 1))
+    return ordered[rank]
+
+def classification_metrics(labels, predictions):
+    # 'yes' (a yes/no question) is the positive class. Questions the backend failed to classify ('error') are counted as errors,
+    # and left out of accuracy/precision/recall, so a failing model shows up as failing rather than as answering 'no'
+    errors = sum(1 for p in predictions if p == 'error')
+    answered = [i for i,p in enumerate(predictions) if p != 'error']
+    labels, predictions = [labels[i] for i in answered], [predictions[i] for i in answered]
+    true_pos = sum(1 for l,p in zip(labels, predictions) if l == 'yes' and p == 'yes')
+    false_pos = sum(1 for l,p in zip(labels, predictions) if l == 'no' and p == 'yes')
+    false_neg = sum(1 for l,p in zip(labels, predictions) if l == 'yes' and p == 'no')
+    correct = sum(1 for l,p in zip(labels, predictions) if l == p)
+    return {
+        'accuracy': correct / len(labels) if labels else float('nan'),
+        'precision': true_pos / (true_pos + false_pos) if true_pos + false_pos else float('nan'),
+        'recall': true_pos / (true_pos + false_neg) if true_pos + false_neg else float('nan'),
+        'errors': errors,
+    }
+
+def peak_rss_mb():
+    # peak resident memory of this process so far
+    try:
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak / 1024**2 if sys.platform == 'darwin' else peak / 1024 # bytes on macOS, kilobytes on linux
+    except ImportError: # windows
+        import psutil
+        memory = psutil.Process().memory_info()
+        return getattr(memory, 'peak_wset', memory.rss) / 1024**2
+
+
+############################### RUN EVALUATION ############################################
+
+def evaluate_backend(backend_name, batch_size, questions, labels, args):
+    # runs in its own process (see below), so peak RSS belongs to this backend alone
+    load_start = time.perf_counter()
+    classify = BACKENDS[backend_name](args)
+    load_seconds = time.perf_counter() - load_start
+
+    predictions, latencies = [], []
+    run_start = time.perf_counter()
+    for start in range(0, len(questions), batch_size):
+        batch = questions[start:start+batch_size]
+        batch_start = time.perf_counter()
+        predictions.extend(classify(batch, batch_size))
+        latencies.extend([time.perf_counter() - batch_start] * len(batch)) # every question in a batch waits for the whole batch
+    run_seconds = time.perf_counter() - run_start
+
+    return {
+        'backend': backend_name,
+        'batch_size': batch_size,
+        'questions': len(questions),
+        **classification_metrics(labels, predictions),
+        'questions_per_second': len(questions) / run_seconds if run_seconds else float('nan'),
+        'p50_latency_ms': percentile(latencies, 50) * 1000,
+        'p99_latency_ms': percentile(latencies, 99) * 1000,
+        'peak_rss_mb': peak_rss_mb(),
+        'load_seconds': load_seconds,
+    }
+
+def print_results(results):
+    header = f"{'backend':<62} {'batch':>5} {'acc':>6} {'prec':>6} {'recall':>6} {'errors':>6} {'q/s':>8} {'p50 ms':>8} {'p99 ms':>8} {'RSS MB':>8}"
+    print(header)
+    print('-' * len(header))
+    for r in results:
+        print(f"{r['backend']:<62} {r['batch_size']:>5} {r['accuracy']:>6.3f} {r['precision']:>6.3f} {r['recall']:>6.3f} {r['errors']:>6} "
+              f"{r['questions_per_second']:>8.2f} {r['p50_latency_ms']:>8.1f} {r['p99_latency_ms']:>8.1f} {r['peak_rss_mb']:>8.0f}")
+
+def append_results(results, results_path):
+    fields = ['date', 'backend', 'batch_size', 'questions', 'accuracy', 'precision', 'recall', 'errors', 'questions_per_second',
+              'p50_latency_ms', 'p99_latency_ms', 'peak_rss_mb', 'load_seconds']
+    write_header = not os.path.isfile(results_path)
+    if not write_header:
+        with open(results_path, 'r', newline='') as file:
+            old_rows = list(csv.DictReader(file))
+        if old_rows and list(old_rows[0].keys()) != fields: # written by an older version with different columns: rewrite with the current ones
+            with open(results_path, 'w', newline='') as file:
+                writer = csv.DictWriter(file, fieldnames=fields, extrasaction='ignore')
+                writer.writeheader()
+                writer.writerows(old_rows)
+    date = datetime.now().strftime('%Y-%m-%d %H:%M')
+    with open(results_path, 'a', newline='') as file:
+        writer = csv.DictWriter(file, fieldnames=fields)
+        if write_header: writer.writeheader()
+        for r in results:
+            writer.writerow({'date': date, **{k: (round(v, 4) if isinstance(v, float) else v) for k,v in r.items()}})
+
+
+if __name__ == "__main__":
+    args = parse_inputs()
+    questions, labels = load_labeled_questions(args.dataset, args.all_questions, args.limit)
+    print(f'Evaluating {len(args.backends)} backend(s) on {len(questions)} labeled questions from {args.dataset}')
+
+    results = []
+    for backend_name in args.backends:
+        for batch_size in args.batch_sizes:
+            print(f'Starting backend: {backend_name} (batch size {batch_size})')
+            with ProcessPoolExecutor(max_workers=1) as executor: # fresh process per run, for a clean peak RSS measurement
+                results.append(executor.submit(evaluate_backend, backend_name, batch_size, questions, labels, args).result())
+
+    print_results(results)
+    append_results(results, args.results)
+    print(f'Appended results to {args.results}')
@@ -0,0 +1,83 @@
+"""
+Tests for the LLM backend (yesno_llm.py) against the stand-in server in dev/fake_llm_server.py, started on a free port.
+They can be run from the top of the repository with: python -m pytest dev
+"""
+
+import os, sys, time, itertools, threading
+from types import SimpleNamespace
+from http.server import ThreadingHTTPServer
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__)))) # so we can import yesno_llm.py from the top of the repository
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import fake_llm_server
+from yesno_llm import LLMClassifier
+
+YES_NO_QUESTIONS = ['DID YOU SEE HIM?', 'WAS IT DARK?', 'IS THAT YOUR CAR?']
+OTHER_QUESTIONS = ['WHAT TIME WAS IT?', 'WHERE WERE YOU?', 'WHO WAS THERE?']
+
+@pytest.fixture
+def server_url():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), fake_llm_server.make_handler(latency=0, error_rate=0.5))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f'http://127.0.0.1:{server.server_address[1]}/v1'
+    server.shutdown()
+    server.server_close()
+
+@pytest.fixture
+def never_rate_limited(monkeypatch):
+    monkeypatch.setattr(fake_llm_server, 'random', SimpleNamespace(random=lambda: 1.0))
+
+
+def test_packs_questions_and_keeps_their_order(server_url, never_rate_limited):
+    questions = [q for pair in zip(YES_NO_QUESTIONS * 4, OTHER_QUESTIONS * 4) for q in pair] # 24, alternating
+    classifier = LLMClassifier(base_url=server_url, questions_per_request=5)
+    results = classifier(questions)
+    assert [r['label'] for r in results] == ['LABEL_0', 'LABEL_1'] * 12
+    assert len(classifier.request_latencies) == 5 # 24 questions in packs of 5
+    assert classifier.retries == 0
+
+def test_retries_after_429_with_retry_after(server_url, monkeypatch):
+    # the first two requests are rate limited (the server asks to retry after 0.1 seconds), then it answers
+    answers = itertools.chain([0.0, 0.0], itertools.repeat(1.0))
+    monkeypatch.setattr(fake_llm_server, 'random', SimpleNamespace(random=lambda: next(answers)))
+    classifier = LLMClassifier(base_url=server_url)
+    start = time.perf_counter()
+    results = classifier(YES_NO_QUESTIONS)
+    assert time.perf_counter() - start >= 0.2
+    assert [r['label'] for r in results] == ['LABEL_0'] * 3
+    assert classifier.retries == 2
+
+def test_rate_limit_holds_across_calls(server_url, never_rate_limited):
+    # 20 calls of one request each at 600 requests/minute: after the first burst of max_concurrency requests, one every 0.1 seconds
+    classifier = LLMClassifier(base_url=server_url, requests_per_minute=600, max_concurrency=8)
+    start = time.perf_counter()
+    for _ in range(20):
+        classifier(YES_NO_QUESTIONS)
+    assert time.perf_counter() - start >= (20 - 8) * 0.1 * 0.9
+
+def test_incomplete_answers_are_split_without_retrying(server_url, never_rate_limited, monkeypatch):
+    # the server drops the last answer of every pack of more than one question
+    answer_prompt = fake_llm_server.answer_prompt
+    monkeypatch.setattr(fake_llm_server, 'answer_prompt', lambda prompt: '\n'.join(answer_prompt(prompt).split('\n')[:-1]) if '\n2. ' in prompt else answer_prompt(prompt))
+    classifier = LLMClassifier(base_url=server_url, questions_per_request=4)
+    start = time.perf_counter()
+    results = classifier(YES_NO_QUESTIONS + OTHER_QUESTIONS[:1])
+    assert [r['label'] for r in results] == ['LABEL_0'] * 3 + ['LABEL_1']
+    assert classifier.retries == 0
+    assert time.perf_counter() - start < 1 # no backoff
+
+def test_unanswerable_question_gives_error_marker(server_url, never_rate_limited, monkeypatch):
+    monkeypatch.setattr(fake_llm_server, 'answer_prompt', lambda prompt: 'I am not sure.')
+    classifier = LLMClassifier(base_url=server_url, questions_per_request=2)
+    results = classifier(YES_NO_QUESTIONS)
+    assert [r['label'] for r in results] == ['ERROR'] * 3
+    assert classifier.unanswered == 3
+
+def test_null_content_gives_error_marker(server_url, never_rate_limited, monkeypatch):
+    # e.g. a response cut off by a content filter: a 200 with no answer text shouldn't stop the run
+    monkeypatch.setattr(fake_llm_server, 'answer_prompt', lambda prompt: None)
+    classifier = LLMClassifier(base_url=server_url, questions_per_request=2)
+    results = classifier(YES_NO_QUESTIONS)
+    assert [r['label'] for r in results] == ['ERROR'] * 3
+    assert classifier.unanswered == 3
@@ -0,0 +1,184 @@
+"""
+Optional SQLite store for the results of yesno.py and word_search.py, so questions like "yes/no percentage by examiner across
+all our trials" can be answered with one query instead of re-reading every output CSV.
+Results are saved with --results_db, e.g.: python yesno.py /path/to/RT/directory --results_db results.sqlite
+Common cross-trial summaries can then be printed with: python results_db.py results.sqlite examiners
+(other summaries: cases, witnesses, terms, questions -- run python results_db.py --help for options)
+Re-running an analysis on the same case replaces that case's earlier results, so each case is only counted once.
+"""
+
+import os, re, csv, sqlite3, argparse
+from datetime import datetime
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    case_id TEXT NOT NULL,          -- get_unique_id(), e.g. case-BA075063_date-2024-07-31_17-50
+    case_number TEXT NOT NULL,      -- e.g. BA075063 (or the case_id, if no case number was found)
+    analysis TEXT NOT NULL,         -- 'yesno' or 'word_search'
+    input_path TEXT,
+    saved_at TEXT,
+    PRIMARY KEY (case_id, analysis)
+);
+CREATE TABLE IF NOT EXISTS questions (
+    case_id TEXT NOT NULL,
+    case_number TEXT NOT NULL,
+    witness TEXT,
+    examiner TEXT,
+    line INTEGER,
+    page TEXT,
+    question TEXT,
+    is_yes_no INTEGER,              -- 1 or 0
+    decided_by TEXT                 -- 'answer' (the answer was clearly yes/no) or 'model'
+);
+CREATE TABLE IF NOT EXISTS examiner_stats (
+    case_id TEXT NOT NULL,
+    case_number TEXT NOT NULL,
+    witness TEXT,
+    examiner TEXT,
+    yes_no_questions INTEGER,
+    total_questions INTEGER,
+    interruptions INTEGER
+);
+CREATE TABLE IF NOT EXISTS hits (
+    case_id TEXT NOT NULL,
+    case_number TEXT NOT NULL,
+    term TEXT,
+    witness TEXT,
+    examiner TEXT,
+    speaker TEXT,
+    page TEXT,
+    file_name TEXT,
+    file_page INTEGER
+);
+CREATE INDEX IF NOT EXISTS questions_case ON questions (case_number);
+CREATE INDEX IF NOT EXISTS questions_examiner ON questions (examiner, is_yes_no);
+CREATE INDEX IF NOT EXISTS questions_witness ON questions (witness, is_yes_no);
+CREATE INDEX IF NOT EXISTS examiner_stats_case ON examiner_stats (case_number);
+CREATE INDEX IF NOT EXISTS examiner_stats_examiner ON examiner_stats (examiner);
+CREATE INDEX IF NOT EXISTS hits_case ON hits (case_number);
+CREATE INDEX IF NOT EXISTS hits_term ON hits (term);
+CREATE INDEX IF NOT EXISTS hits_speaker ON hits (speaker);
+"""
+
+
+############################### WRITING RESULTS ###########################################
+
+def connect(db_path):
+    conn = sqlite3.connect(db_path)
+    conn.execute('PRAGMA journal_mode=WAL') # lets queries run while another analysis is writing
+    conn.executescript(SCHEMA)
+    return conn
+
+def get_case_number(case_id):
+    # get_unique_id() gives 'case-<number>_date-<date>' when it finds a case number, otherwise just 'date-<date>'
+    match = re.match(r'^case-(.*)_date-', case_id)
+    return match.group(1) if match else case_id
+
+def start_run(conn, case_id, analysis, input_path, tables):
+    # replace any earlier results for this case, so re-running a case doesn't count it twice
+    case_number = get_case_number(case_id)
+    for table in tables:
+        conn.execute(f'DELETE FROM {table} WHERE case_number = ?', (case_number,))
+    conn.execute('DELETE FROM runs WHERE case_number = ? AND analysis = ?', (case_number, analysis))
+    conn.execute('INSERT INTO runs VALUES (?, ?, ?, ?, ?)', (case_id, case_number, analysis, os.path.abspath(input_path), datetime.now().isoformat(timespec='seconds')))
+    return case_number
+
+def save_yesno_results(db_path, case_id, input_path, name_to_stats, question_records):
+    if any('ci_low' in stats for values in name_to_stats.values() for stats in values.values()):
+        raise ValueError('Quick estimate results (see yesno.py --error_target) are not saved to the results database, which only holds exact counts.')
+    conn = connect(db_path)
+    with conn: # one transaction
+        case_number = start_run(conn, case_id, 'yesno', input_path, ['questions', 'examiner_stats'])
+        conn.executemany('INSERT INTO questions VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)', [
+            (case_id, case_number, r['witness'], r['examiner'], r['line'], r.get('page'), r['question'],
+             None if r['is_yes_no'] is None else int(r['is_yes_no']), r['decided_by'])
+            for r in question_records])
+        conn.executemany('INSERT INTO examiner_stats VALUES (?, ?, ?, ?, ?, ?, ?)', [
+            (case_id, case_number, witness, examiner, stats['yes_no_questions'], stats['total_questions'], stats['interruptions'])
+            for witness,values in name_to_stats.items() for examiner,stats in values.items()])
+    conn.close()
+    print(f'Saved {len(question_records)} questions to {db_path}')
+
+def save_word_search_results(db_path, case_id, input_path, hit_records):
+    conn = connect(db_path)
+    with conn:
+        case_number = start_run(conn, case_id, 'word_search', input_path, ['hits'])
+        conn.executemany('INSERT INTO hits VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)', [
+            (case_id, case_number, r['term'], r['witness'], r['examiner'], r['speaker'], r['page'], r['file_name'], r['file_page'])
+            for r in hit_records])
+    conn.close()
+    print(f'Saved {len(hit_records)} search hits to {db_path}')
+
+
+############################### QUERIES ###################################################
+
+# each query takes optional filters (case number, examiner, witness, term) and returns (column names, rows)
+QUERIES = {
+    'cases': """
+        SELECT case_number AS "Case", GROUP_CONCAT(analysis) AS "Analyses", MAX(saved_at) AS "Saved", input_path AS "Input path"
+        FROM runs WHERE (:case IS NULL OR case_number = :case)
+        GROUP BY case_number ORDER BY case_number""",
+    'examiners': """
+        SELECT examiner AS "Examiner", COUNT(DISTINCT case_number) AS "Cases", SUM(yes_no_questions) AS "Yes/No Questions",
+               SUM(total_questions) AS "Total questions", ROUND(100.0 * SUM(yes_no_questions) / SUM(total_questions), 2) AS "Yes/No Percentage",
+               SUM(interruptions) AS "Interruptions"
+        FROM examiner_stats WHERE (:case IS NULL OR case_number = :case) AND (:examiner IS NULL OR examiner = :examiner)
+        GROUP BY examiner ORDER BY SUM(total_questions) DESC""",
+    'witnesses': """
+        SELECT case_number AS "Case", witness AS "Witness", examiner AS "Examiner", SUM(yes_no_questions) AS "Yes/No Questions",
+               SUM(total_questions) AS "Total questions", ROUND(100.0 * SUM(yes_no_questions) / SUM(total_questions), 2) AS "Yes/No Percentage",
+               SUM(interruptions) AS "Interruptions"
+        FROM examiner_stats WHERE (:case IS NULL OR case_number = :case) AND (:examiner IS NULL OR examiner = :examiner) AND (:witness IS NULL OR witness = :witness)
+        GROUP BY case_number, witness, examiner ORDER BY case_number, witness, examiner""",
+    'terms': """
+        SELECT term AS "Term", COUNT(*) AS "Count", COUNT(DISTINCT case_number) AS "Cases"
+        FROM hits WHERE (:case IS NULL OR case_number = :case) AND (:term IS NULL OR term = :term) AND (:examiner IS NULL OR examiner = :examiner)
+        GROUP BY term ORDER BY COUNT(*) DESC""",
+    'questions': """
+        SELECT case_number AS "Case", witness AS "Witness", examiner AS "Examiner", page AS "Page", question AS "Question",
+               is_yes_no AS "Yes/No", decided_by AS "Decided by"
+        FROM questions WHERE (:case IS NULL OR case_number = :case) AND (:examiner IS NULL OR examiner = :examiner) AND (:witness IS NULL OR witness = :witness)
+        ORDER BY case_number, line LIMIT :limit""",
+}
+
+def run_query(db_path, query_name, case=None, examiner=None, witness=None, term=None, limit=100):
+    conn = connect(db_path)
+    params = {'case': case, 'examiner': examiner and examiner.upper(), 'witness': witness and witness.upper(), 'term': term and term.upper(), 'limit': limit}
+    cursor = conn.execute(QUERIES[query_name], params)
+    columns = [c[0] for c in cursor.description]
+    rows = cursor.fetchall()
+    conn.close()
+    return columns, rows
+
+def print_table(columns, rows):
+    widths = [max([len(str(c))] + [len(str(r[i])) for r in rows]) for i,c in enumerate(columns)]
+    widths = [min(w, 80) for w in widths] # long questions get cut off
+    print('  '.join(str(c).ljust(w) for c,w in zip(columns, widths)))
+    print('  '.join('-' * w for w in widths))
+    for row in rows:
+        print('  '.join(str(v)[:w].ljust(w) for v,w in zip(row, widths)))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Cross-trial summaries from the results database.')
+    parser.add_argument('db', type=str, help='Path to the SQLite results database (created with --results_db).')
+    parser.add_argument('query', type=str, choices=list(QUERIES.keys()), help='Which summary to print.')
+    parser.add_argument('--case', type=str, default=None, help='Only include this case number.')
+    parser.add_argument('--examiner', type=str, default=None, help='Only include this examiner.')
+    parser.add_argument('--witness', type=str, default=None, help='Only include this witness.')
+    parser.add_argument('--term', type=str, default=None, help='Only include this search term.')
+    parser.add_argument('--limit', type=int, default=100, help='Maximum number of questions to list (for the questions query).')
+    parser.add_argument('--csv', type=str, default=None, help='Also save the summary to this CSV file.')
+    args = parser.parse_args()
+
+    if not os.path.isfile(args.db):
+        raise ValueError(f"The database '{args.db}' does not exist or is not a file.")
+
+    columns, rows = run_query(args.db, args.query, args.case, args.examiner, args.witness, args.term, args.limit)
+    print_table(columns, rows)
+    if args.csv:
+        with open(args.csv, 'w', newline='') as file:
+            writer = csv.writer(file)
+            writer.writerow(columns)
+            writer.writerows(rows)
+        print(f'Saved to {args.csv}')
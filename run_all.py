@@ -0,0 +1,131 @@
+"""
+This script runs both analyses (yesno.py and word_search.py) over a transcript in one go, and produces the same three CSV files.
+Running the two scripts separately reads the PDFs twice and works out the witnesses/examiners twice; this reads the PDFs once,
+works out who is testifying and examining once (iter_transcript_structure in yesno.py), and then runs the yes/no analysis and
+the word search side by side on that shared stream of lines.
+It can be run with: python run_all.py /path/to/RT/directory
+(it takes the options of both scripts, e.g. --search_terms, --backend, --error_target, --results_db)
+"""
+# %pip install -r requirements.txt
+
+import os, queue, argparse, threading
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+import yesno, word_search
+from yesno import timed_stage
+
+
+############################### PROCESS COMMAND LINE ARGUMENTS ############################
+
+def parse_inputs(SEARCH_TERM_PATH='./word_search_terms.csv'):
+    parser = argparse.ArgumentParser(description='Transcript yes/no analysis and word search, in one pass.')
+    parser.add_argument('path', type=str, nargs='?', default='./dev/example_transcripts', help='Path to the input directory of transcript files.')
+    parser.add_argument('--search_terms', type=str, default=None, help='Path to the optional CSV file of additional search terms.')
+    parser.add_argument('--results_db', type=str, default=None, help='Optional SQLite database to also save the results to, for queries across trials (see results_db.py).')
+    parser.add_argument('--error_target', type=float, default=None, help='Quick estimate mode for the yes/no analysis (see yesno.py).')
+    parser.add_argument('--confidence', type=float, default=0.95, help='Confidence level of the quick estimate intervals (default 0.95).')
+    yesno.add_classifier_arguments(parser)
+    args = parser.parse_args()
+
+    if not os.path.isdir(args.path):
+        raise ValueError(f"The input directory '{args.path}' does not exist or is not a directory.")
+    if args.search_terms and not os.path.isfile(args.search_terms):
+        raise ValueError(f"The CSV file '{args.search_terms}' does not exist or is not a file.")
+    yesno.check_estimate_arguments(args)
+    print(f'Running program on files at: {args.path}')
+
+    search_terms = word_search.csv_to_arr(SEARCH_TERM_PATH)
+    if args.search_terms:
+        print(f'Adding additional search terms from {args.search_terms}')
+        search_terms.extend(word_search.csv_to_arr(args.search_terms))
+    return args, search_terms
+
+
+############################### SHARED PASS ###############################################
+
+def read_transcript(INPUT_DIRECTORY_PATH):
+    # one read of the PDFs for both analyses: all the lines with their page numbers (like word_search.py), and the positions of the lines
+    # that aren't just line numbers (like yesno.py). Those lines are exactly the lines yesno.get_lines() would give
+    lines_with_pages = word_search.get_lines_pages(INPUT_DIRECTORY_PATH)
+    kept = word_search.get_text_line_positions([l for l,_,_,_ in lines_with_pages])
+    return lines_with_pages, kept
+
+def broadcast(iterable, n_consumers, chunk_size=1000):
+    """
+    Runs through `iterable` once (in a background thread) and gives each of n_consumers its own iterator over the same items.
+    The queues are unbounded, so one slow (or failed) consumer never holds up the others; at most they hold one transcript's worth of lines.
+    """
+    queues = [queue.Queue() for _ in range(n_consumers)]
+
+    def produce():
+        try:
+            chunk = []
+            for item in iterable:
+                chunk.append(item)
+                if len(chunk) == chunk_size:
+                    for q in queues: q.put(chunk)
+                    chunk = []
+            for q in queues: q.put(chunk)
+            for q in queues: q.put(None) # finished
+        except Exception as error:
+            for q in queues: q.put(error) # consumers re-raise it
+    threading.Thread(target=produce, daemon=True).start()
+
+    def consume(q):
+        while True:
+            chunk = q.get()
+            if chunk is None:
+                return
+            if isinstance(chunk, Exception):
+                raise chunk
+            yield from chunk
+    return [consume(q) for q in queues]
+
+def run_timed(name, function, *args):
+    with timed_stage(name):
+        return function(*args)
+
+
+############################### RUN ALL ###################################################
+
+if __name__ == "__main__":
+    start_time = datetime.now()
+
+    args, search_terms = parse_inputs()
+    INPUT_DIRECTORY_PATH = args.path
+    yesno.apply_tuning_profile()
+    yesno.start_loading_classifier(args.backend, yesno.get_llm_options(args)) # loads while the PDFs are read
+
+    with timed_stage('PDF extraction'):
+        lines_with_pages, kept = read_transcript(INPUT_DIRECTORY_PATH)
+    lines = [lines_with_pages[j][0] for j in kept]
+    with timed_stage('default examiners'):
+        DEFAULT_EXAMINER_KEY = yesno.get_default_examiners(lines)
+
+    # one structural parse, consumed by both analyses at the same time (the word search maps it back onto all the lines, like word_search.py does)
+    yesno_structure, search_structure = broadcast(yesno.iter_transcript_structure(lines), 2)
+    question_records = [] if args.results_db else None
+    hit_records = [] if args.results_db else None
+    with timed_stage('analyses (both, side by side)'):
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            yesno_job = executor.submit(run_timed, 'yes/no analysis', yesno.analyze_transcript, lines, DEFAULT_EXAMINER_KEY,
+                                        question_records, args.error_target, args.confidence, yesno_structure)
+            search_job = executor.submit(run_timed, 'word search', word_search.word_search, lines_with_pages, search_terms,
+                                         DEFAULT_EXAMINER_KEY, hit_records, search_structure, kept)
+            name_to_stats = yesno_job.result()
+            results_totals, results_df = search_job.result()
+
+    unique_id = yesno.get_unique_id(lines)
+    yesno.write_output(name_to_stats, INPUT_DIRECTORY_PATH, unique_id)
+    word_search.write_output(results_totals, results_df, INPUT_DIRECTORY_PATH, unique_id)
+    if args.results_db:
+        from results_db import save_yesno_results, save_word_search_results
+        for record in question_records: # here we know which page each question is on
+            record['page'] = lines_with_pages[kept[record['line']]][1]
+        save_yesno_results(args.results_db, unique_id, INPUT_DIRECTORY_PATH, name_to_stats, question_records)
+        save_word_search_results(args.results_db, unique_id, INPUT_DIRECTORY_PATH, hit_records)
+
+    end_time = datetime.now()
+    elapsed_minutes = (end_time - start_time).total_seconds() / 60
+    yesno.print_stage_timings()
+    print(f"Script took {elapsed_minutes:.2f} minutes")
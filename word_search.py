@@ -25,10 +25,12 @@ def parse_inputs(SEARCH_TERM_PATH='./word_search_terms.csv'):
     Returns:
         input_dir (str): Path to the input directory containing RT files.
         search_terms (arr): All search terms, including additional ones, to search for.
+        results_db (str): Path to the SQLite results database, or None if results shouldn't be saved to one.
     """
     parser = argparse.ArgumentParser(description="Process input paths for RT files and optional search terms.")
     parser.add_argument('path', type=str, nargs='?', default='./dev/example_transcripts', help='Path to the input directory of transcript files.')
     parser.add_argument('--search_terms', type=str, default=None, help='Path to the optional CSV file of additional search terms.')
+    parser.add_argument('--results_db', type=str, default=None, help='Optional SQLite database to also save the results to, for queries across trials (see results_db.py).')
     args = parser.parse_args()
 
     if not os.path.isdir(args.path):
@@ -44,62 +46,20 @@ def parse_inputs(SEARCH_TERM_PATH='./word_search_terms.csv'):
         print(f'Adding additional search terms from {args.path}')
         search_terms.extend(csv_to_arr(args.search_terms))
 
-    return args.path, search_terms
+    return args.path, search_terms, args.results_db
 
 
-# helper function for PDF reading: gets the page number from the text of one page of a PDF
-def get_page_number(page_text, last_num):
-    """
-    Pages will either start with a line containing just the page number, or several lines containing all the line numbers, with the last one 
-    also containing the page number. This function isolates just the page number.
-    """
-    lines = [l for l in page_text.split('\n') if bool(re.search(r'\S', l)) ] # filters out lines with only whitespace
-    if len(lines) == 0: return 'unknown'
-    
-    def no_punctuation(t):
-        return re.sub(r'[().,?!\-"\':;/]', '', t)
-
-    # first, let's see if the first line is a digit -- this is probably the page number
-    firstline = no_punctuation(lines[0]).strip()
-    if firstline.isdigit():
-        if int(firstline) > 100 or (int(firstline) < 100 and str(last_num+1) in firstline): # digit is bigger than line numbers or exactly equal to the last number plus one: this is probably the page number!
-            return firstline
-    if re.sub(' ', '', firstline) == str(last_num+1):
-        return str(last_num+1)
-    
-    # otherwise, either the first line isn't a digit, or it is a low number (likely a line number, not a page number)
-    # so, we'll loop through and look for the page number
-    # a first loop will look for the last_num+1
-    for l in lines:
-        l = no_punctuation(l).strip()
-        if last_num > 50 and str(last_num+1) in l: # if the line is short and we see the next number up from the last, it's safe to conclude it's that
-            return str(last_num+1)
-        
-    # if still not found, we'll look for just this format:
-    for l in lines:
-        l = no_punctuation(l).strip()
-        if re.fullmatch(r'\d+ \d+', l) or re.fullmatch(r'\d+ \d+ \d+', l): # two or three numbers, separated by a space
-            return l.split(' ')[-1].strip() # return the last
-        
-    # didn't find it
-    return 'unknown'
-    
-
 # Read PDFs to text
 def get_lines_pages(INPUT_DIRECTORY_PATH):
     """
     Returns a list where each item is (line_text, true_page_num, file_name, file_page_num
     """
     
-    files = [f for f in sorted(os.listdir(INPUT_DIRECTORY_PATH)) if f.endswith('.pdf')]
-
     lines_with_pages = []
     last_num = 0
-    for file in tqdm(files, total=len(files), desc="Reading PDFs..."):
-       reader = PdfReader(os.path.join(INPUT_DIRECTORY_PATH, file))
+    for file,pages in extract_pdf_pages(INPUT_DIRECTORY_PATH, desc="Reading PDFs..."): # text extraction can run in parallel, page numbering can't
 
-       for file_page_num,page in enumerate(reader.pages):
-           page_text = page.extract_text()
+       for file_page_num,page_text in enumerate(pages):
            curr_page_num = get_page_number(page_text, last_num)
 
            lines_with_pages.extend( [(line, curr_page_num, file, file_page_num+1) for line in page_text.split('\n')] )
@@ -111,6 +71,11 @@ def get_lines_pages(INPUT_DIRECTORY_PATH):
 
 
 ## HELPERS FOR WORD SEARCH
+def get_text_line_positions(lines):
+    # positions of the lines that aren't just line numbers (the lines yesno.get_lines() keeps). Who is testifying and examining is worked out
+    # on these, like in yesno.py: a line number between e.g. a witness's name and "called as a witness" would otherwise hide the witness
+    return [j for j,line in enumerate(lines) if not re.match(r'^[\d\s]*$', line)]
+
 def line_starts_with_speaker_name(line):
     if ':' not in line:
         return False
@@ -135,40 +100,41 @@ def guess_speaker(lines, i, current_witness, current_examiner):
 
 
 
-def word_search(lines_with_pages, search_terms, DEFAULT_EXAMINER_KEY):
+# (if hit_records is a list, one record per search hit is also appended to it, e.g. for the results database)
+# (structure is the output of iter_transcript_structure(lines), if it has already been worked out elsewhere)
+# (structure_index maps each line number in structure to its position in lines_with_pages, see get_text_line_positions)
+def word_search(lines_with_pages, search_terms, DEFAULT_EXAMINER_KEY, hit_records=None, structure=None, structure_index=None):
     lines = [l for l,_,_,_ in lines_with_pages]
+    if structure is None:
+        structure_index = get_text_line_positions(lines)
+        structure = iter_transcript_structure([lines[j] for j in structure_index])
 
     results_totals = defaultdict(int)
     results_df = 'Search term,True page number,File name,Within-file page number,Speaker\n'
 
-    current_witness = ''
-    current_witness_side = ''
-    current_examination = ''
-    current_examiner = ''
+    guessed_examiner = '' # if the examiner identifier was missed, our guess (until the next examination/examiner identifier)
 
-    for i,(currline,true_page,filename,file_page) in enumerate(lines_with_pages):
-  
-        # keep track of these so we can guess the speaker of the word
-        if line_is_witness_identifier(lines, i):
-            current_witness = clean_simple_line(currline)
-            current_witness_side = who_presents_this_witness(lines, i)
+    # keep track of the witness and examiner (iter_transcript_structure) so we can guess the speaker of the word
+    for i,currline,kind,current_witness,current_witness_side,current_examination,current_examiner in structure:
+        i = structure_index[i] # (so guess_speaker looks back over all the lines)
+        _,true_page,filename,file_page = lines_with_pages[i]
 
-        elif line_is_examination_identifier(lines, i):
-            current_examiner = ''
-            current_examination = clean_simple_line(currline)
-
-        elif line_is_examiner_identifier(currline):
-            current_examiner = clean_examiner_name(currline)
+        if kind in ['examination', 'examiner']:
+            guessed_examiner = ''
+        current_examiner = current_examiner or guessed_examiner
 
         for term in search_terms:
             if f' {term} ' in currline: # term surrounded with spaces, so it's not just part of another word
                 results_totals[term] += 1
 
                 if current_examiner == '': # we may have missed this before, and have to guess now
-                    current_examiner = guess_examiner(current_witness_side, current_examination, DEFAULT_EXAMINER_KEY) 
-                speaker = guess_speaker([l for l,_,_,_ in lines_with_pages], i, current_witness, current_examiner)
+                    current_examiner = guessed_examiner = guess_examiner(current_witness_side, current_examination, DEFAULT_EXAMINER_KEY) 
+                speaker = guess_speaker(lines, i, current_witness, current_examiner)
 
                 results_df += f'{term},{true_page},{filename},{file_page},{speaker}\n'
+                if hit_records is not None:
+                    hit_records.append({'term': term, 'witness': current_witness, 'examiner': current_examiner, 'speaker': speaker,
+                                        'page': true_page, 'file_name': filename, 'file_page': file_page})
 
     print(f'Finished searching transcript, saving output.')
     return dict(results_totals), results_df
@@ -193,14 +159,20 @@ def write_output(results_totals, results_df, INPUT_DIRECTORY_PATH, unique_id):
 if __name__ == "__main__":
     start_time = datetime.now()
 
-    INPUT_DIRECTORY_PATH, search_terms = parse_inputs()
+    INPUT_DIRECTORY_PATH, search_terms, results_db = parse_inputs()
+    apply_tuning_profile()
     lines_with_pages = get_lines_pages(INPUT_DIRECTORY_PATH)
-    DEFAULT_EXAMINER_KEY = get_default_examiners([l for l,_,_,_ in lines_with_pages])
+    lines = [l for l,_,_,_ in lines_with_pages]
+    DEFAULT_EXAMINER_KEY = get_default_examiners([lines[j] for j in get_text_line_positions(lines)])
     
-    results_totals, results_df = word_search(lines_with_pages, search_terms, DEFAULT_EXAMINER_KEY)
+    hit_records = [] if results_db else None
+    results_totals, results_df = word_search(lines_with_pages, search_terms, DEFAULT_EXAMINER_KEY, hit_records)
 
-    unique_id = get_unique_id([l for l,_,_,_ in lines_with_pages])
+    unique_id = get_unique_id(lines)
     write_output(results_totals, results_df, INPUT_DIRECTORY_PATH, unique_id)
+    if results_db:
+        from results_db import save_word_search_results
+        save_word_search_results(results_db, unique_id, INPUT_DIRECTORY_PATH, hit_records)
 
     end_time = datetime.now()
     elapsed_minutes = (end_time - start_time).total_seconds() / 60
@@ -2,55 +2,164 @@
 This script analyses a transcript to quantify how many yes/no questions each witness is asked. 
 It uses a question classification model someone else wrote.
 It can be run with: python yesno.py /path/to/RT/directory
+(add --backend llm to classify questions with an OpenAI-compatible LLM server instead, see yesno_llm.py)
 """
 # %pip install -r requirements.txt
 
-import os, re, argparse
+import os, re, json, math, time, queue, random, argparse, platform, threading, multiprocessing
 from datetime import datetime
+from contextlib import contextmanager
 from pypdf import PdfReader
 from tqdm import tqdm
 from collections import defaultdict
-from transformers import pipeline, AutoTokenizer, AutoModelForSequenceClassification
-from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from statistics import NormalDist
+from concurrent.futures import Future, ProcessPoolExecutor
 
 # all code is now factored into functions, which are all called at the bottom of this script
+# (transformers is only imported when the model is loaded, so importing this script stays quick, see extract_pdf_pages)
 
 ############################### PROCESS COMMAND LINE ARGUMENTS ############################
 
-def parse_input_path():
+def add_classifier_arguments(parser):
+    # question classification options (also used by other scripts that classify questions)
+    parser.add_argument('--backend', type=str, default='local', choices=['local', 'llm'], help='Classify questions with the local model (default) or an OpenAI-compatible LLM server.')
+    parser.add_argument('--llm_base_url', type=str, default='https://api.openai.com/v1', help='Base URL of the OpenAI-compatible server (for --backend llm).')
+    parser.add_argument('--llm_model', type=str, default='gpt-3.5-turbo', help='Model name to request from the LLM server.')
+    parser.add_argument('--llm_api_key', type=str, default=None, help='API key for the LLM server (alternatives: OPENAI_API_KEY environment variable, or a file called key.txt in this directory).')
+    parser.add_argument('--questions_per_request', type=int, default=25, help='How many questions to pack into each LLM request.')
+    parser.add_argument('--max_concurrency', type=int, default=8, help='Maximum number of LLM requests in flight at once.')
+    parser.add_argument('--requests_per_minute', type=int, default=500, help='LLM rate limit, in requests per minute.')
+    parser.add_argument('--tokens_per_minute', type=int, default=200000, help='LLM rate limit, in tokens per minute.')
+
+def get_llm_options(args):
+    api_key = args.llm_api_key or os.environ.get('OPENAI_API_KEY')
+    if not api_key and os.path.isfile('key.txt'):
+        with open('key.txt', 'r') as f:
+            api_key = f.read().strip()
+    return {'base_url': args.llm_base_url, 'model': args.llm_model, 'api_key': api_key, 'questions_per_request': args.questions_per_request,
+            'max_concurrency': args.max_concurrency, 'requests_per_minute': args.requests_per_minute, 'tokens_per_minute': args.tokens_per_minute}
+
+def parse_inputs():
     parser = argparse.ArgumentParser(description='Transcript yes/no analysis.')
     parser.add_argument('path', type=str, nargs='?', default='./dev/example_transcripts', help='Path to the input directory of transcript files.')
+    parser.add_argument('--results_db', type=str, default=None, help='Optional SQLite database to also save the results to, for queries across trials (see results_db.py).')
+    parser.add_argument('--error_target', type=float, default=None, help='Quick estimate mode: only classify a random sample of the questions, enough to estimate each Yes/No Percentage to within this many percentage points.')
+    parser.add_argument('--confidence', type=float, default=0.95, help='Confidence level of the quick estimate intervals (default 0.95).')
+    add_classifier_arguments(parser)
     args = parser.parse_args()
     if not os.path.isdir(args.path):
         raise ValueError(f"The input directory '{args.path}' does not exist or is not a directory.")
+    check_estimate_arguments(args)
     print(f'Running program on files at: {args.path}')
-    return args.path
+    return args
 
+def check_estimate_arguments(args):
+    # quick estimate options (also used by run_all.py)
+    if args.error_target is not None and not 0 < args.error_target <= 100:
+        raise ValueError(f"The error target must be more than 0 and at most 100 percentage points, not {args.error_target}.")
+    if not 0 < args.confidence < 1:
+        raise ValueError(f"The confidence level must be between 0 and 1 (e.g. 0.95), not {args.confidence}.")
+    if args.error_target is not None and args.results_db:
+        # the database only holds exact counts: an estimate would be summed as if it were exact, and would replace the case's exact results
+        raise ValueError("Quick estimates (--error_target) can't be saved to the results database (--results_db). Run without one of them.")
 
-############################### DATA LOADING AND PROCESSING ###############################
 
-def get_lines(INPUT_DIRECTORY_PATH):
+############################### DATA LOADING AND PROCESSING ###############################
 
-    files = [f for f in sorted(os.listdir(INPUT_DIRECTORY_PATH)) if f.endswith('.pdf')]
+EXTRACTION_WORKERS = 1 # how many PDFs to read at once (in separate processes). Set by the tuning profile, see calibrate.py
+
+def extract_file_pages(file_path):
+    return [page.extract_text() for page in PdfReader(file_path).pages]
+
+def extract_pdf_pages(INPUT_DIRECTORY_PATH, workers=None, files=None, desc="Processing PDFs to text..."):
+    # returns [(file name, [text of each page])] for the PDFs in the directory, in order. Each PDF can be read in a separate process
+    files = files or [f for f in sorted(os.listdir(INPUT_DIRECTORY_PATH)) if f.endswith('.pdf')]
+    paths = [os.path.join(INPUT_DIRECTORY_PATH, f) for f in files]
+    workers = min(workers or EXTRACTION_WORKERS, len(files)) or 1
+    if workers == 1:
+        pages = [extract_file_pages(path) for path in tqdm(paths, total=len(files), desc=desc)]
+    else:
+        # 'spawn' starts fresh processes instead of forking this one, which may be loading the model in a background thread at the same time
+        # (forking a process with threads running can deadlock the child). Each process imports the running script again, which is quick
+        with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn')) as executor:
+            pages = list(tqdm(executor.map(extract_file_pages, paths), total=len(files), desc=desc))
+    return list(zip(files, pages))
+
+def get_lines(INPUT_DIRECTORY_PATH, with_pages=False):
+    # Read all the PDFs into a big list of lines, page by page (and, if with_pages, also return the true page number of each line)
+    lines, line_pages = [], []
+    last_num = 0
+    for file,pages in extract_pdf_pages(INPUT_DIRECTORY_PATH):
+        for page_text in pages:
+            page_num = get_page_number(page_text, last_num)
+            if page_num.isdigit():
+                last_num = int(page_num)
+
+            # Separate into lines, and filter out the ones that are just line numbers, e.g. "24 "
+            page_lines = [line for line in page_text.split('\n') if not re.match(r'^[\d\s]*$', line)]
+            lines.extend(page_lines)
+            line_pages.extend([page_num] * len(page_lines))
+
+    return (lines, line_pages) if with_pages else lines
+
+# helper function for PDF reading: gets the page number from the text of one page of a PDF (also used by word_search.py)
+def get_page_number(page_text, last_num):
+    """
+    Pages will either start with a line containing just the page number, or several lines containing all the line numbers, with the last one 
+    also containing the page number. This function isolates just the page number.
+    """
+    lines = [l for l in page_text.split('\n') if bool(re.search(r'\S', l)) ] # filters out lines with only whitespace
+    if len(lines) == 0: return 'unknown'
+    
+    def no_punctuation(t):
+        return re.sub(r'[().,?!\-"\':;/]', '', t)
+
+    # first, let's see if the first line is a digit -- this is probably the page number
+    firstline = no_punctuation(lines[0]).strip()
+    if firstline.isdigit():
+        if int(firstline) > 100 or (int(firstline) < 100 and str(last_num+1) in firstline): # digit is bigger than line numbers or exactly equal to the last number plus one: this is probably the page number!
+            return firstline
+    if re.sub(' ', '', firstline) == str(last_num+1):
+        return str(last_num+1)
+    
+    # otherwise, either the first line isn't a digit, or it is a low number (likely a line number, not a page number)
+    # so, we'll loop through and look for the page number
+    # a first loop will look for the last_num+1
+    for l in lines:
+        l = no_punctuation(l).strip()
+        if last_num > 50 and str(last_num+1) in l: # if the line is short and we see the next number up from the last, it's safe to conclude it's that
+            return str(last_num+1)
+        
+    # if still not found, we'll look for just this format:
+    for l in lines:
+        l = no_punctuation(l).strip()
+        if re.fullmatch(r'\d+ \d+', l) or re.fullmatch(r'\d+ \d+ \d+', l): # two or three numbers, separated by a space
+            return l.split(' ')[-1].strip() # return the last
+        
+    # didn't find it
+    return 'unknown'
 
-    # Read all the PDFs into a huge string, and then split into a big list of lines
-    entire_transcript = ""
-    for file in tqdm(files, total=len(files), desc="Processing PDFs to text..."):
-        reader = PdfReader(os.path.join(INPUT_DIRECTORY_PATH, file))
-        for page in reader.pages:
-            entire_transcript += page.extract_text() + '\n'
 
-    # Separate into lines, and filter out the ones that are just line numbers, e.g. "24 "
-    lines = entire_transcript.split('\n')
-    lines = [line for line in lines if not re.match(r'^[\d\s]*$', line)]
+############################### LOAD QUESTION CLASSIFIER ###################################
 
-    return lines
+BATCH_SIZE = 16 # how many questions the classifier is handed at a time
+MAX_LENGTH = None # longest question (in tokens) the model reads before cutting it off. None means the model's own limit
+# (these, EXTRACTION_WORKERS and torch's thread counts can be tuned to this computer with calibrate.py, see TUNING PROFILE below)
 
+classifier = None
+def init_classifier(backend='local', llm_options=None, skip=None):
+    # (skip is the Event of a background load, see start_loading_classifier)
+    global classifier
 
-############################### LOAD QUESTION CLASSIFIER ###################################
+    if backend == 'llm':
+        # OpenAI-compatible server instead of the local model. It is called the same way as the local pipeline
+        from yesno_llm import LLMClassifier
+        classifier = LLMClassifier(**(llm_options or {}))
+        print(f"Using LLM backend: {classifier.model} at {classifier.base_url}")
+        return
 
-classifier = None
-def init_classifier():
+    apply_torch_threads() # (from the tuning profile)
+    from transformers import pipeline, AutoTokenizer, AutoModelForSequenceClassification
     # load question classification model from local. Or, if local doesn't exist, download from HuggingFace and save to local
     local_model_path = './model_local'
     model_name = 'PrimeQA/tydi-boolean_question_classifier-xlmr_large-20221117'
@@ -58,7 +167,8 @@ def init_classifier():
     try: 
         # try to load local model
         tokenizer = AutoTokenizer.from_pretrained(local_model_path)
-        model = AutoModelForSequenceClassification.from_pretrained(local_model_path)
+        if skip is not None and skip.is_set(): return # nothing to classify after all (see start_loading_classifier)
+        model = load_local_model(local_model_path)
         print(f"Loaded model from {local_model_path}")
     except: 
         # If loading locally fails, download and save the model
@@ -69,9 +179,123 @@ def init_classifier():
         model.save_pretrained(local_model_path)
         print(f"Downloaded and saved model to {local_model_path}")
 
-    global classifier
     classifier = pipeline("text-classification", model=model, tokenizer=tokenizer)
 
+def load_local_model(local_model_path):
+    from transformers import AutoModelForSequenceClassification
+    # weights are memory-mapped straight from model.safetensors, instead of being read into memory and then copied into the model
+    if not any(os.path.isfile(os.path.join(local_model_path, f)) for f in ['model.safetensors', 'model.safetensors.index.json']):
+        # older local copies were saved as pytorch_model.bin: convert once, so later runs can memory-map
+        model = AutoModelForSequenceClassification.from_pretrained(local_model_path)
+        model.save_pretrained(local_model_path, safe_serialization=True)
+        print(f"Converted {local_model_path} to safetensors")
+        return model
+    return AutoModelForSequenceClassification.from_pretrained(local_model_path, use_safetensors=True, low_cpu_mem_usage=True)
+
+#### loading the model in the background
+# loading the model takes a while, but uses different resources than reading the PDFs, so the two can overlap:
+# start_loading_classifier() begins loading in a background thread, and wait_for_classifier() blocks until it is ready.
+# if it turns out there are no questions for the model, skip_classifier_loading() stops the load early (or just stops waiting on it)
+
+classifier_loader = None
+skip_loading = None # each background load gets its own Event, so skipping one load never affects a later one
+
+def start_loading_classifier(backend='local', llm_options=None):
+    global classifier_loader, skip_loading
+    classifier_loader = loader = Future()
+    skip_loading = skip = threading.Event()
+    def load():
+        try:
+            with timed_stage('model load (background)'):
+                init_classifier(backend, llm_options, skip)
+            loader.set_result(classifier)
+        except BaseException as error:
+            loader.set_exception(error)
+    threading.Thread(target=load, daemon=True).start() # daemon, so we never have to wait for a load we skipped before exiting
+
+def wait_for_classifier():
+    global classifier_loader, skip_loading
+    if classifier_loader is None: # not loading in the background: either loaded already, or load it now
+        if classifier is None: init_classifier()
+        return
+    with timed_stage('waiting for model'):
+        classifier_loader.result()
+    classifier_loader = skip_loading = None
+
+def skip_classifier_loading():
+    global classifier_loader, skip_loading
+    if classifier_loader is not None:
+        skip_loading.set()
+        print('No questions need the model, skipping model load.')
+    classifier_loader = skip_loading = None
+
+
+############################### TUNING PROFILE ############################################
+# the best batch size, max length, thread counts and number of PDF reading processes depend on the computer.
+# calibrate.py measures them on this computer and saves them to tuning_profile.json, which the scripts load at startup
+
+TUNING_PROFILE_PATH = './tuning_profile.json'
+
+def get_machine_description():
+    # profiles are only used on the computer they were measured on
+    return {'hostname': platform.node(), 'processor': platform.processor() or platform.machine(), 'cpu_count': os.cpu_count()}
+
+TORCH_THREADS = None # torch's thread counts from the profile (None: torch's own default). Only set when the local model is
+TORCH_INTEROP_THREADS = None # loaded (see apply_torch_threads), so word_search.py and the LLM backend never have to import torch
+
+def apply_tuning_profile(profile_path=TUNING_PROFILE_PATH):
+    global BATCH_SIZE, MAX_LENGTH, EXTRACTION_WORKERS, TORCH_THREADS, TORCH_INTEROP_THREADS
+    if not os.path.isfile(profile_path):
+        return
+    with open(profile_path, 'r') as f:
+        profile = json.load(f)
+    if profile.get('machine') != get_machine_description():
+        print(f'Ignoring {profile_path}: it was measured on a different computer. Run calibrate.py to tune for this one.')
+        return
+
+    settings = profile['settings']
+    BATCH_SIZE = settings.get('batch_size', BATCH_SIZE)
+    MAX_LENGTH = settings.get('max_length', MAX_LENGTH)
+    EXTRACTION_WORKERS = settings.get('extraction_workers', EXTRACTION_WORKERS)
+    TORCH_THREADS = settings.get('torch_threads')
+    TORCH_INTEROP_THREADS = settings.get('torch_interop_threads')
+    print(f'Using tuning profile from {profile_path} (measured {profile.get("date", "?")}): ' + ', '.join(f'{k} {v}' for k,v in settings.items()))
+
+def apply_torch_threads():
+    # called just before the local model is loaded, while torch can still take the inter-op setting
+    if not (TORCH_THREADS or TORCH_INTEROP_THREADS):
+        return
+    import torch
+    if TORCH_THREADS:
+        torch.set_num_threads(TORCH_THREADS)
+    if TORCH_INTEROP_THREADS:
+        try:
+            torch.set_num_interop_threads(TORCH_INTEROP_THREADS)
+        except RuntimeError: # can only be set once, before torch has done any work
+            pass
+
+
+############################### STAGE TIMINGS #############################################
+
+stage_timings = {} # stage name -> seconds
+
+@contextmanager
+def timed_stage(name):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        stage_timings[name] = stage_timings.get(name, 0) + time.perf_counter() - start
+
+def print_stage_timings():
+    print('Stage timings:')
+    for name,seconds in stage_timings.items():
+        print(f'    {name:<32} {seconds:8.2f} s')
+    if 'model load (background)' in stage_timings:
+        # whatever part of the model load we didn't have to wait for happened during PDF reading/parsing
+        saved = stage_timings['model load (background)'] - stage_timings.get('waiting for model', 0)
+        print(f'    {"saved by background model load":<32} {max(0, saved):8.2f} s')
+
 
 ############################### ANALYSIS HELPER FUNCTIONS  ################################
 
@@ -166,6 +390,13 @@ def is_yes_no(question):
         return 'ERROR: unexpected classification result'
     return result == 'LABEL_0' # model returns 'LABEL_0' for yes/no questions and 'LABEL_1' for other questions
 
+def is_yes_no_batch(questions, batch_size=None, max_length=None):
+    # same as is_yes_no, but hands the model a whole list of questions at once so it can run them in padded batches
+    batch_size = batch_size or BATCH_SIZE
+    max_length = max_length or MAX_LENGTH
+    results = classifier(list(questions), batch_size=batch_size, **({'truncation': True, 'max_length': max_length} if max_length else {}))
+    return [r['label'] == 'LABEL_0' if r['label'] in ['LABEL_0', 'LABEL_1'] else 'ERROR: unexpected classification result' for r in results]
+
 #### for interruptions
 def within_answer(lines, i, current_examiner, DEFAULT_EXAMINER_KEY):
     # is this line part of an answer? useful for identifying interruptions
@@ -223,47 +454,185 @@ def guess_examiner(witness_side, current_examination, DEFAULT_EXAMINER_KEY):
         return DEFAULT_EXAMINER_KEY[other_side]
     return 'error: unknown examiner'
 
+# STRUCTURE OF THE TRANSCRIPT
+# both analyses (this one and word_search.py) need to know, at every line, who is testifying and who is examining them.
+# this walks the transcript once and yields that for each line, so the bookkeeping lives in one place (and can be shared, see run_all.py)
+# yields (i, line, kind, witness, witness_side, examination, examiner), where kind is 'witness', 'examination' or 'examiner' for those identifier lines, otherwise None
+# examiner is '' when the examiner identifier was missed: each analysis guesses it (with guess_examiner) when it needs it
 
-###############################  TRANSCRIPT ANALYSIS  #####################################
-
-# loop through transcript to identify questions, and save the ones we need to classify as yes/no questions or not
-def analyze_transcript(lines, DEFAULT_EXAMINER_KEY):
-
+def iter_transcript_structure(lines):
     current_witness = ''
     current_witness_side = ''
     current_examination = ''
     current_examiner = ''
-    name_to_stats = defaultdict(lambda: defaultdict(lambda: {'total_questions': 0, 'yes_no_questions': 0, 'interruptions': 0})) # use default dict so we don't have to check if key already exists
-    questions_to_query = [] # to parallelize later
 
     for i,line in enumerate(lines):
-
+        kind = None
         if line_is_witness_identifier(lines, i):
+            kind = 'witness'
             current_witness = clean_simple_line(line)
             current_witness_side = who_presents_this_witness(lines, i)
 
         elif line_is_examination_identifier(lines, i):
+            kind = 'examination'
             current_examiner = ''
             current_examination = clean_simple_line(line)
 
         elif line_is_examiner_identifier(line):
+            kind = 'examiner'
             current_examiner = clean_examiner_name(line)
 
-        elif is_answer(line):
+        yield i, line, kind, current_witness, current_witness_side, current_examination, current_examiner
+
+
+###############################  QUICK ESTIMATE (SAMPLING)  ###############################
+# for triage we often only need approximate yes/no percentages. In that mode, instead of sending every undecided question to the model,
+# we send a random sample from each witness/examiner pair, just big enough to estimate that pair's Yes/No Percentage to within the error target.
+# the questions decided from their answers are still counted exactly; only the model's share of each percentage is estimated.
+
+def get_sample_size(n_model, n_total, error_target, z):
+    # n_model undecided questions out of n_total for this witness/examiner pair. error_target is in percentage points of the Yes/No Percentage
+    if n_model == 0:
+        return 0
+    margin = error_target / 100 * n_total / n_model # the model's questions are only part of the percentage, so they can be estimated more loosely
+    n_infinite = z**2 * 0.25 / margin**2 # worst case, half of them are yes/no questions
+    n = n_infinite / (1 + (n_infinite - 1) / n_model) # finite population correction: we're sampling from only n_model questions
+    return min(n_model, max(1, math.ceil(n)))
+
+def choose_sample(questions_to_query, name_to_stats, error_target, confidence, seed=0):
+    # stratified random sample: each witness/examiner pair is sampled separately. returns the indices into questions_to_query to classify
+    z = NormalDist().inv_cdf((1 + confidence) / 2)
+    by_pair = defaultdict(list)
+    for index,(_,witness,examiner) in enumerate(questions_to_query):
+        by_pair[(witness, examiner)].append(index)
+    rng = random.Random(seed)
+    sample = []
+    for (witness,examiner),indices in by_pair.items():
+        n = get_sample_size(len(indices), name_to_stats[witness][examiner]['total_questions'], error_target, z)
+        sample.extend(rng.sample(indices, n))
+    return sorted(sample)
+
+def estimate_yes_no(stats, n_model, sampled_results, confidence):
+    # fills in the estimated yes/no questions and confidence interval for one witness/examiner pair, from the sampled model results
+    n, yes = len(sampled_results), sum(result is True for result in sampled_results)
+    if n == 0: # nothing for the model, so the count is exact
+        low_share = high_share = 0
+    else:
+        # Agresti-Coull interval (behaves sensibly when a small sample is all yes or all no), narrowed because we sampled from a finite pile.
+        # it is centred on the adjusted proportion, not on yes/n (which is still the estimate itself)
+        z = NormalDist().inv_cdf((1 + confidence) / 2)
+        p_adjusted = (yes + z**2 / 2) / (n + z**2)
+        fpc = math.sqrt((n_model - n) / (n_model - 1)) if n_model > 1 else 0
+        half_width = z * math.sqrt(p_adjusted * (1 - p_adjusted) / (n + z**2)) * fpc
+        low_share, high_share = max(0, p_adjusted - half_width), min(1, p_adjusted + half_width)
+        low_share, high_share = min(low_share, yes / n), max(high_share, yes / n) # (with almost everything sampled, the narrowed interval could otherwise miss yes/n)
+        if n == n_model: low_share = high_share = yes / n # everything was classified
+    decided_by_answer = stats['yes_no_questions']
+    stats['yes_no_questions'] = round(decided_by_answer + n_model * (yes / n if n else 0), 1)
+    stats['ci_low'] = round((decided_by_answer + n_model * low_share) / stats['total_questions'] * 100, 2)
+    stats['ci_high'] = round((decided_by_answer + n_model * high_share) / stats['total_questions'] * 100, 2)
+    stats['sampled'] = f'{n}/{n_model}'
+
+
+###############################  TRANSCRIPT ANALYSIS  #####################################
+
+QUEUE_BATCHES = 8 # how many batches of questions can wait for the classifier before the transcript loop pauses to let it catch up
+
+# runs alongside the transcript loop below: classifies batches of (index, question) as soon as they are ready, until it gets None
+def classify_question_batches(batch_queue, classifier_results, classifier_errors):
+    progress = tqdm(desc='Classifying questions', unit=' questions')
+    yes_no_so_far = 0
+    pending = [] # questions taken from the queue but not classified yet
+    finished = False
+    while not finished:
+        batches = [batch_queue.get()]
+        # if the classifier is behind, more batches will be waiting: take them all at once (bigger batches, and more packing for the LLM backend)
+        while batches[-1] is not None:
+            try:
+                batches.append(batch_queue.get_nowait())
+            except queue.Empty:
+                break
+        if batches[-1] is None:
+            finished = True
+            batches.pop()
+        pending.extend(item for batch in batches for item in batch)
+        if not pending or classifier_errors:
+            pending = []
+            continue # after an error, keep emptying the queue so the transcript loop never gets stuck waiting on it
+
+        try:
+            wait_for_classifier() # the model may still be loading in the background
+            # the LLM backend is only fast with enough questions to fill all its concurrent requests, so it waits for that many
+            if not finished and len(pending) < getattr(classifier, 'questions_per_call', 0):
+                continue
+            items, pending = pending, []
+            with timed_stage('classification'):
+                results = is_yes_no_batch([q for _,q in items])
+        except Exception as error:
+            classifier_errors.append(error)
+            continue
+
+        for (index,_),result in zip(items, results):
+            classifier_results[index] = result
+        yes_no_so_far += sum(result is True for result in results)
+        progress.update(len(items))
+        progress.set_postfix({'yes/no so far': f'{yes_no_so_far / progress.n:.0%}'})
+    progress.close()
+    if hasattr(classifier, 'summary'): # (LLM backend)
+        print(classifier.summary())
+
+# loop through transcript to identify questions, and send the ones we need to classify as yes/no questions or not to the classifier as we go
+# (if question_records is a list, one record per question is also appended to it, e.g. for the results database)
+# (if error_target is set, only a sample of the questions is classified once the whole transcript is read, see QUICK ESTIMATE above)
+# (structure is the output of iter_transcript_structure(lines), if it has already been worked out elsewhere)
+def analyze_transcript(lines, DEFAULT_EXAMINER_KEY, question_records=None, error_target=None, confidence=0.95, structure=None):
+
+    guessed_examiner = '' # if the examiner identifier was missed, our guess (until the next examination/examiner identifier)
+    name_to_stats = defaultdict(lambda: defaultdict(lambda: {'total_questions': 0, 'yes_no_questions': 0, 'interruptions': 0})) # use default dict so we don't have to check if key already exists
+    questions_to_query = [] # everything sent to the classifier
+    query_records = [] # records of the questions in questions_to_query, filled in once the model has answered
+
+    # the classifier works through batches of questions in the background while we keep reading the transcript.
+    # the queue is bounded, so if the classifier falls behind, put() waits until it catches up
+    batch_queue = queue.Queue(maxsize=QUEUE_BATCHES)
+    classifier_results, classifier_errors = {}, [] # question index -> result, and anything that went wrong in the classifier
+    consumer = threading.Thread(target=classify_question_batches, args=(batch_queue, classifier_results, classifier_errors), daemon=True)
+    consumer.start()
+    next_batch = []
+
+    parse_start = time.perf_counter()
+    for i,line,kind,current_witness,current_witness_side,current_examination,current_examiner in (structure or iter_transcript_structure(lines)):
+
+        if kind in ['examination', 'examiner']:
+            guessed_examiner = ''
+        current_examiner = current_examiner or guessed_examiner
+
+        if kind is None and is_answer(line):
 
             if current_examiner == '': # we may have missed this before, and have to guess now
-                current_examiner = guess_examiner(current_witness_side, current_examination, DEFAULT_EXAMINER_KEY) 
+                current_examiner = guessed_examiner = guess_examiner(current_witness_side, current_examination, DEFAULT_EXAMINER_KEY) 
 
             question = get_previous_question(lines, i, current_examiner) 
                 
             if '?' in question: # to rule out things like "Q. Good morning."
                 name_to_stats[current_witness][current_examiner]['total_questions'] += 1
                 
+                record = {'line': i, 'witness': current_witness, 'examiner': current_examiner, 'question': clean_question(question)}
                 if is_yes_no_answer(lines, i, current_examiner): # this function catches answers that are easy to see are yes/no answers, so we don't have to waste time querying the model
                     name_to_stats[current_witness][current_examiner]['yes_no_questions'] += 1
+                    record.update({'is_yes_no': True, 'decided_by': 'answer'})
                 else:
-                    # not able to identify it as yes/no, add this question (and identifying information) to the pile of questions to query later
+                    # not able to identify it as yes/no, add this question (and identifying information) to the next batch for the classifier
                     questions_to_query.append((clean_question(question), current_witness, current_examiner))
+                    record.update({'is_yes_no': None, 'decided_by': 'model'})
+                    query_records.append(record)
+                    if error_target is None: # (for a quick estimate we need every question before we can sample)
+                        next_batch.append((len(questions_to_query)-1, clean_question(question)))
+                        if len(next_batch) == BATCH_SIZE:
+                            batch_queue.put(next_batch)
+                            next_batch = []
+                if question_records is not None:
+                    question_records.append(record)
 
         # identify an interruption
         if line.strip().endswith('--') and within_answer(lines, i, current_examiner, DEFAULT_EXAMINER_KEY):
@@ -271,6 +640,15 @@ def analyze_transcript(lines, DEFAULT_EXAMINER_KEY):
             if next_speaker:
                 name_to_stats[current_witness][next_speaker]['interruptions'] += 1
 
+    stage_timings['parsing'] = time.perf_counter() - parse_start
+    sample = None
+    if error_target is not None:
+        sample = choose_sample(questions_to_query, name_to_stats, error_target, confidence)
+        print(f'Quick estimate: classifying {len(sample)} of {len(questions_to_query)} questions the model is needed for.')
+        next_batch = [(index, questions_to_query[index][0]) for index in sample]
+    for start in range(0, len(next_batch), BATCH_SIZE):
+        batch_queue.put(next_batch[start:start+BATCH_SIZE])
+    batch_queue.put(None) # no more questions
 
     # these fields aren't relevant for the court (just interruptions)
     for witness,stats in name_to_stats.items():
@@ -279,14 +657,37 @@ def analyze_transcript(lines, DEFAULT_EXAMINER_KEY):
             stats['COURT']['yes_no_questions'] = None
                     
 
-    print(f'Finished reading transcript, querying model with questions.')
-    # execute question classification (in parallel)
-    with ThreadPoolExecutor() as executor:
-        classifier_results = list(executor.map(is_yes_no, [q for q,_,_ in questions_to_query]))
+    if not questions_to_query or sample == []: # every question was decided from its answer, so we don't need the model at all
+        skip_classifier_loading()
+    else:
+        print(f'Finished reading transcript, waiting for the model to finish the remaining questions.')
+    consumer.join()
+    if classifier_errors:
+        raise classifier_errors[0]
+
+    # a question the classifier couldn't answer (an error marker instead of True/False, e.g. the LLM server never answered it) counts as not yes/no
+    errors = sum(not isinstance(result, bool) for result in classifier_results.values())
+    if errors:
+        print(f'Warning: {errors} question(s) could not be classified, and were counted as not yes/no.')
 
     # add the results of these queries to our stats
-    for (_,witness,examiner),result in zip(questions_to_query, classifier_results):
-        name_to_stats[witness][examiner]['yes_no_questions'] += result
+    if error_target is None:
+        for index,((_,witness,examiner),record) in enumerate(zip(questions_to_query, query_records)):
+            name_to_stats[witness][examiner]['yes_no_questions'] += classifier_results[index] is True
+            record['is_yes_no'] = classifier_results[index] if isinstance(classifier_results[index], bool) else None
+    else:
+        n_model, sampled_results = defaultdict(int), defaultdict(list)
+        for index,((_,witness,examiner),record) in enumerate(zip(questions_to_query, query_records)):
+            n_model[(witness, examiner)] += 1
+            if index in classifier_results:
+                sampled_results[(witness, examiner)].append(classifier_results[index])
+                record['is_yes_no'] = classifier_results[index] if isinstance(classifier_results[index], bool) else None
+            else:
+                record['decided_by'] = 'not sampled'
+        for witness,values in name_to_stats.items():
+            for examiner,stats in values.items():
+                if stats['total_questions']: # (not the court)
+                    estimate_yes_no(stats, n_model[(witness, examiner)], sampled_results[(witness, examiner)], confidence)
 
     print(f'Finished analyzing transcript, saving output.')
     return name_to_stats
@@ -302,7 +703,10 @@ def get_unique_id(lines):
         return datetag
 
 def write_output(name_to_stats, INPUT_DIRECTORY_PATH, unique_id):
-    output_csv_text = 'Witness,Examiner,Yes/No Questions,Total questions,Yes/No Percentage,Interruptions\n'
+    # quick estimates (see QUICK ESTIMATE above) get confidence interval columns, and a different file name so they're never mistaken for exact counts
+    estimated = any('ci_low' in stats for values in name_to_stats.values() for stats in values.values())
+    output_csv_text = 'Witness,Examiner,Yes/No Questions,Total questions,Yes/No Percentage,Interruptions'
+    output_csv_text += ',Yes/No Percentage CI Low,Yes/No Percentage CI High,Model Questions Sampled\n' if estimated else '\n'
 
     for name,values in name_to_stats.items():
         for examiner, stats in values.items():
@@ -312,9 +716,10 @@ def write_output(name_to_stats, INPUT_DIRECTORY_PATH, unique_id):
             except:
                 percentage = 'N/A'
             output_csv_text += f'{percentage},'
-            output_csv_text += f'{stats["interruptions"]}\n'
+            output_csv_text += f'{stats["interruptions"]}'
+            output_csv_text += f',{stats.get("ci_low", "N/A")},{stats.get("ci_high", "N/A")},{stats.get("sampled", "N/A")}\n' if estimated else '\n'
 
-    output_path = os.path.join(INPUT_DIRECTORY_PATH, f'yesno_analysis_{unique_id}.csv')
+    output_path = os.path.join(INPUT_DIRECTORY_PATH, f'yesno_{"estimate" if estimated else "analysis"}_{unique_id}.csv')
 
     with open(output_path, 'w') as file:
         file.write(output_csv_text)
@@ -325,16 +730,28 @@ def write_output(name_to_stats, INPUT_DIRECTORY_PATH, unique_id):
 if __name__ == "__main__":
     start_time = datetime.now()
             
-    INPUT_DIRECTORY_PATH = parse_input_path()
-    lines = get_lines(INPUT_DIRECTORY_PATH)
-    init_classifier()
-    DEFAULT_EXAMINER_KEY = get_default_examiners(lines)
-
-    name_to_stats = analyze_transcript(lines, DEFAULT_EXAMINER_KEY)
+    args = parse_inputs()
+    INPUT_DIRECTORY_PATH = args.path
+    apply_tuning_profile()
+    start_loading_classifier(args.backend, get_llm_options(args)) # loads while the PDFs are read, see start_loading_classifier
+    with timed_stage('PDF extraction'):
+        lines, line_pages = get_lines(INPUT_DIRECTORY_PATH, with_pages=True)
+    with timed_stage('default examiners'):
+        DEFAULT_EXAMINER_KEY = get_default_examiners(lines)
+
+    question_records = [] if args.results_db else None
+    with timed_stage('analysis (parse + classify)'):
+        name_to_stats = analyze_transcript(lines, DEFAULT_EXAMINER_KEY, question_records, args.error_target, args.confidence)
 
     unique_id = get_unique_id(lines)
     write_output(name_to_stats, INPUT_DIRECTORY_PATH, unique_id)
+    if args.results_db:
+        from results_db import save_yesno_results
+        for record in question_records:
+            record['page'] = line_pages[record['line']]
+        save_yesno_results(args.results_db, unique_id, INPUT_DIRECTORY_PATH, name_to_stats, question_records)
 
     end_time = datetime.now()
     elapsed_minutes = (end_time - start_time).total_seconds() / 60
+    print_stage_timings()
     print(f"Script took {elapsed_minutes:.2f} minutes")
\ No newline at end of file
@@ -0,0 +1,224 @@
+"""
+LLM question classification backend for yesno.py (python yesno.py /path/to/RT/directory --backend llm).
+Instead of one blocking request per question (like dev/yesno_GPT_VERSION.py), it packs many numbered questions into each
+request and sends the requests concurrently with asyncio, under a concurrency limit and a token-bucket rate limit, retrying
+with backoff when the server is busy. It works with any OpenAI-compatible chat completions endpoint, e.g. OpenAI itself,
+a local server, or dev/fake_llm_server.py for testing.
+"""
+
+import re, time, random, asyncio, threading
+from concurrent.futures import ThreadPoolExecutor
+import httpx
+
+SYSTEM_PROMPT = 'You are an expert at identifying yes/no questions, and at analyzing courtroom transcripts.'
+USER_PROMPT = ("For each numbered question below, decide whether it is a yes or no question. "
+               "Respond with one line per question in the format '<number>. yes' or '<number>. no', and nothing else.\n\n")
+
+
+############################### PROMPTS ###################################################
+
+def build_prompt(questions):
+    return USER_PROMPT + '\n'.join(f'{n}. {question}' for n,question in enumerate(questions, start=1))
+
+def parse_answers(text, n_questions):
+    # returns a list of True/False for each question, or None if the response doesn't answer every question
+    answers = {}
+    for line in text.split('\n'):
+        match = re.match(r'^\s*(\d+)\s*[.):\-]?\s*(yes|no)\b', line.strip(), flags=re.IGNORECASE)
+        if match:
+            answers[int(match.group(1))] = match.group(2).lower() == 'yes'
+    if not all(n in answers for n in range(1, n_questions+1)):
+        return None
+    return [answers[n] for n in range(1, n_questions+1)]
+
+def estimate_tokens(text):
+    return len(text) // 4 + 1 # rough rule of thumb for english text, good enough for rate limiting
+
+
+############################### RATE LIMITING #############################################
+
+TOKEN_BURST_SECONDS = 5 # the token bucket saves up at most this many seconds' worth of tokens (and starts with one second's worth)
+
+class TokenBucket:
+    """
+    Allows `rate` units per second on average, with bursts of up to `capacity` units (starting with `initial` units).
+    It keeps its state in time.monotonic() and a thread lock rather than in an event loop, so one bucket keeps limiting
+    across every call to the classifier, each of which runs its own event loop.
+    """
+
+    def __init__(self, rate, capacity, initial=None):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity if initial is None else initial
+        self.last_refill = time.monotonic()
+        self.lock = threading.Lock()
+
+    def reserve(self, amount=1):
+        # takes `amount` units now (possibly going into debt) and returns how many seconds to wait before using them.
+        # later callers wait behind the debt, so requests are let through first come, first served
+        amount = min(amount, self.capacity) # a single huge request shouldn't wait forever
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.last_refill) * self.rate)
+            self.last_refill = now
+            self.tokens -= amount
+            return max(0, -self.tokens / self.rate)
+
+    async def acquire(self, amount=1):
+        wait = self.reserve(amount)
+        if wait:
+            await asyncio.sleep(wait)
+
+
+############################### CLASSIFIER ################################################
+
+class RetryableError(Exception):
+    # the server is busy or unreachable: worth sending the same request again after a pause
+    def __init__(self, message, retry_after=None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+class IncompleteAnswerError(Exception):
+    # the response didn't answer every question. At temperature 0 the same request gets the same answer, so split it instead of retrying
+    pass
+
+class LLMClassifier:
+    """
+    Can be used in place of the HuggingFace pipeline in yesno.py: calling it with a list of questions returns
+    [{'label': 'LABEL_0'}, ...] with 'LABEL_0' for yes/no questions and 'LABEL_1' for other questions, like the local model
+    (and 'ERROR' for a question the server never gave a usable answer for).
+    The rate limits apply across all calls: the buckets are created once, with the classifier.
+    """
+
+    def __init__(self, base_url='https://api.openai.com/v1', model='gpt-3.5-turbo', api_key=None, questions_per_request=25,
+                 max_concurrency=8, requests_per_minute=500, tokens_per_minute=200000, max_retries=6, timeout=60):
+        self.base_url = base_url.rstrip('/')
+        self.model = model
+        self.api_key = api_key
+        self.questions_per_request = questions_per_request
+        self.max_concurrency = max_concurrency
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self.max_retries = max_retries
+        self.timeout = timeout
+        self.request_bucket = TokenBucket(requests_per_minute / 60, max(1, max_concurrency))
+        self.token_bucket = TokenBucket(tokens_per_minute / 60, tokens_per_minute / 60 * TOKEN_BURST_SECONDS, initial=tokens_per_minute / 60)
+
+        # recorded for every call, see summary()
+        self.request_latencies = []
+        self.retries = 0
+        self.questions_classified = 0
+        self.unanswered = 0
+        self.elapsed_seconds = 0.0
+
+    @property
+    def questions_per_call(self):
+        # how many questions one call needs to keep every concurrent request full. Callers that can wait (see yesno.py) collect this many first
+        return self.questions_per_request * self.max_concurrency
+
+    def __call__(self, questions, batch_size=None, **tokenizer_options):
+        # batch_size and tokenizer options (max_length...) are accepted (and ignored) so this can be called exactly like the HuggingFace pipeline
+        single = isinstance(questions, str)
+        results = self.classify(questions if not single else [questions])
+        return [{'label': 'ERROR' if result is None else 'LABEL_0' if result else 'LABEL_1'} for result in results]
+
+    def classify(self, questions):
+        # runs the async classification from normal (synchronous) code, including from inside a notebook's event loop
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            return asyncio.run(self.classify_async(questions))
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            return executor.submit(asyncio.run, self.classify_async(questions)).result()
+
+    async def classify_async(self, questions):
+        questions = list(questions)
+        if not questions:
+            return []
+        start = time.perf_counter()
+
+        # the semaphore and connection pool belong to this event loop (the rate limit buckets are shared by every call, see __init__)
+        self.semaphore = asyncio.Semaphore(self.max_concurrency)
+        headers = {'Authorization': f'Bearer {self.api_key}'} if self.api_key else {}
+        limits = httpx.Limits(max_connections=self.max_concurrency, max_keepalive_connections=self.max_concurrency)
+
+        async with httpx.AsyncClient(base_url=self.base_url, headers=headers, timeout=self.timeout, limits=limits) as client:
+            chunks = [questions[i:i+self.questions_per_request] for i in range(0, len(questions), self.questions_per_request)]
+            chunk_results = await asyncio.gather(*[self.classify_chunk(client, chunk) for chunk in chunks])
+
+        self.questions_classified += len(questions)
+        self.elapsed_seconds += time.perf_counter() - start
+        return [result for chunk in chunk_results for result in chunk]
+
+    async def classify_chunk(self, client, questions):
+        # returns True/False for each question, or None for a question the server never answered properly
+        try:
+            return await self.request_with_retries(client, questions)
+        except IncompleteAnswerError:
+            if len(questions) == 1:
+                self.unanswered += 1
+                return [None]
+            # long packed requests are the likeliest to come back truncated or garbled, so split in half and try again
+            half = len(questions) // 2
+            first, second = await asyncio.gather(self.classify_chunk(client, questions[:half]), self.classify_chunk(client, questions[half:]))
+            return first + second
+        except RetryableError:
+            # still busy after every retry. Splitting would only send the busy server more requests
+            self.unanswered += len(questions)
+            return [None] * len(questions)
+
+    async def request_with_retries(self, client, questions):
+        # only busy/unreachable server errors are retried (with backoff), incomplete answers go straight back to classify_chunk
+        for attempt in range(self.max_retries + 1):
+            try:
+                return await self.request(client, questions)
+            except RetryableError as error:
+                if attempt == self.max_retries:
+                    raise
+                self.retries += 1
+                backoff = error.retry_after if error.retry_after is not None else min(60, 2 ** attempt) * random.uniform(0.5, 1.5)
+                await asyncio.sleep(backoff)
+
+    async def request(self, client, questions):
+        prompt = build_prompt(questions)
+        max_tokens = 8 * len(questions) + 16 # '123. yes\n' is a handful of tokens per question
+        payload = {
+            'model': self.model,
+            'messages': [{'role': 'system', 'content': SYSTEM_PROMPT}, {'role': 'user', 'content': prompt}],
+            'temperature': 0,
+            'max_tokens': max_tokens,
+        }
+
+        await self.request_bucket.acquire()
+        await self.token_bucket.acquire(estimate_tokens(SYSTEM_PROMPT + prompt) + max_tokens)
+        async with self.semaphore:
+            start = time.perf_counter()
+            try:
+                response = await client.post('/chat/completions', json=payload)
+            except (httpx.TimeoutException, httpx.TransportError) as error:
+                raise RetryableError(f'request failed: {error!r}')
+            self.request_latencies.append(time.perf_counter() - start)
+
+        if response.status_code == 429 or response.status_code >= 500:
+            retry_after = response.headers.get('retry-after')
+            raise RetryableError(f'server returned {response.status_code}', float(retry_after) if retry_after and retry_after.replace('.', '', 1).isdigit() else None)
+        response.raise_for_status() # other errors (bad key, bad model name...) won't be fixed by retrying
+
+        try: # a 200 in an unexpected shape (not JSON, no choices, content null e.g. after a content filter) is an unusable answer, not a crash
+            content = response.json()['choices'][0]['message']['content']
+        except (TypeError, KeyError, ValueError, IndexError):
+            content = None
+        if not isinstance(content, str):
+            raise IncompleteAnswerError('response had no answer text')
+        answers = parse_answers(content, len(questions))
+        if answers is None:
+            raise IncompleteAnswerError('response did not answer every question')
+        return answers
+
+    def summary(self):
+        latencies = sorted(self.request_latencies)
+        def percentile(p):
+            return latencies[min(len(latencies)-1, int(p / 100 * len(latencies)))] * 1000 if latencies else float('nan')
+        rate = self.questions_classified / self.elapsed_seconds if self.elapsed_seconds else float('nan')
+        return (f'LLM backend: {self.questions_classified} questions in {len(latencies)} requests ({self.retries} retries, {self.unanswered} unanswered), '
+                f'{rate:.1f} questions/second, request latency p50 {percentile(50):.0f} ms / p99 {percentile(99):.0f} ms')